@@ -4,7 +4,7 @@ Bridges PaygoGPT + ChatbotBuilder -> Azure Speech Services
 
 Endpoints:
   GET  /              -> health check
-  GET  /health        -> detailed health + ffmpeg check
+  GET  /health        -> detailed health + PyAV/ffmpeg check
   POST /assess        -> one-shot mode (CBB + quick test)
   POST /assess-text   -> text-only mode (social media)
   WS   /assess-stream -> continuous mode (full session, real-time)
@@ -12,59 +12,295 @@ Endpoints:
   POST /encrypt-pdf   -> PDF encryption with pikepdf
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_sock import Sock
-import os, requests, base64, json, subprocess, tempfile, struct, threading, time
+from cachetools import TTLCache, LRUCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from formatter import format_response, tier_label, SESSION_LABELS
+import os, requests, httpx, msgspec, base64, orjson, subprocess, tempfile, struct, threading, time, hashlib, functools, queue, re
 
 app  = Flask(__name__)
 CORS(app)
 sock = Sock(app)
 
+def jsonify(payload):
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
 def get_azure_key():    return os.environ.get('AZURE_SPEECH_KEY', '')
 def get_azure_region(): return os.environ.get('AZURE_SPEECH_REGION', 'canadaeast')
 
+# One pooled session for audio downloads, so keep-alive connections (and
+# their TLS handshakes) are reused across requests. It fetches arbitrary
+# user URLs, so Azure credentials never go on it.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                                      max_retries=Retry(total=2, backoff_factor=0.1)))
+SESSION.mount('http://',  HTTPAdapter(pool_connections=32, pool_maxsize=64))
+
+# Azure gets its own HTTP/2 client: concurrent assessments are multiplexed
+# as streams over one TLS connection instead of one connection each.
+AZURE_CLIENT = httpx.Client(
+    timeout=30.0,
+    transport=httpx.HTTPTransport(
+        http2=True, retries=2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)))
+
 # Audio helpers
 
-def convert_to_wav(input_bytes, input_suffix='.webm'):
-    try:
-        with tempfile.NamedTemporaryFile(suffix=input_suffix, delete=False) as f:
+def wav_header(data_size, sample_rate=16000):
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16,
+        1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', data_size)
+
+def decode_to_wav(input_bytes):
+    """In-process decode + resample to 16 kHz mono s16 WAV with PyAV."""
+    import av, io
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=16000)
+    pcm = []
+    with av.open(io.BytesIO(input_bytes)) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                pcm.append(memoryview(out.planes[0])[:out.samples * 2])
+    for out in resampler.resample(None):
+        pcm.append(memoryview(out.planes[0])[:out.samples * 2])
+    # Frame buffers are viewed, not copied; the join below is the only copy.
+    return b''.join([wav_header(sum(map(len, pcm))), *pcm])
+
+def run_ffmpeg(source, input_bytes=None):
+    # Raw PCM over stdout rather than -f wav: ffmpeg cannot seek back on a
+    # pipe to fill in the RIFF sizes, so the header is written here instead.
+    result = subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', source,
+        '-f', 's16le', '-ar', '16000', '-ac', '1', 'pipe:1'
+    ], input=input_bytes, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode())
+    return wav_header(len(result.stdout)) + result.stdout
+
+def ffmpeg_to_wav(input_bytes):
+    # MP4/M4A often keeps its moov atom at the end of the file, which ffmpeg
+    # cannot reach on a non-seekable pipe, so those still go via a temp file.
+    suffix = detect_audio_suffix(input_bytes)
+    if suffix == '.mp4':
+        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
             f.write(input_bytes)
-            in_path = f.name
-        out_path = in_path.replace(input_suffix, '.wav')
-        result = subprocess.run([
-            'ffmpeg', '-y', '-i', in_path,
-            '-ar', '16000', '-ac', '1', '-sample_fmt', 's16', out_path
-        ], capture_output=True)
-        os.unlink(in_path)
-        if result.returncode != 0:
-            return None, result.stderr.decode()
-        with open(out_path, 'rb') as f:
-            wav = f.read()
-        os.unlink(out_path)
-        return wav, None
+            f.flush()
+            return run_ffmpeg(f.name)
+    return run_ffmpeg('pipe:0', input_bytes)
+
+def convert_to_wav(input_bytes):
+    try:
+        try:
+            return decode_to_wav(input_bytes), None
+        except ImportError:
+            return ffmpeg_to_wav(input_bytes), None
     except Exception as e:
         return None, str(e)
 
-def download_and_convert(audio_url):
+WAV_CONTENT_TYPE  = 'audio/wav; codecs=audio/pcm; samplerate=16000'
+OPUS_CONTENT_TYPE = 'audio/ogg; codecs=opus'
+
+def native_content_type(raw):
+    """Content-Type for audio Azure accepts without transcoding, else None:
+    Ogg/Opus, or canonical 16 kHz mono 16-bit PCM WAV."""
+    if raw[:4] == b'OggS' and raw[28:36] == b'OpusHead':
+        return OPUS_CONTENT_TYPE
+    if raw[:4] == b'RIFF' and raw[8:16] == b'WAVEfmt ' and len(raw) >= 36:
+        fmt, channels, rate = struct.unpack_from('<HHI', raw, 20)
+        bits = struct.unpack_from('<H', raw, 34)[0]
+        if (fmt, channels, rate, bits) == (1, 1, 16000, 16):
+            return WAV_CONTENT_TYPE
+    return None
+
+def prepare_audio(raw):
+    """Returns (audio_bytes, content_type, error), transcoding only if needed."""
+    content_type = native_content_type(raw)
+    if content_type:
+        return raw, content_type, None
+    wav, err = convert_to_wav(raw)
+    if wav: return wav, WAV_CONTENT_TYPE, None
+    return None, None, err
+
+STREAM_CHUNK    = 64 * 1024
+MIN_AUDIO_BYTES = 1024
+MAX_AUDIO_BYTES = 5 * 1024 * 1024
+
+def audio_size_error(size):
+    if size < MIN_AUDIO_BYTES: return f"audio too small ({size} bytes)"
+    if size > MAX_AUDIO_BYTES: return f"audio too large ({size} bytes, max {MAX_AUDIO_BYTES})"
+    return None
+
+PREFETCH_DEPTH  = 16
+EXECUTOR        = ThreadPoolExecutor(max_workers=32, thread_name_prefix='audio')
+
+def prefetch(chunks, depth=PREFETCH_DEPTH):
+    """Generator that drains `chunks` on EXECUTOR into a bounded queue, so the
+    source download runs ahead while the consumer (the Azure upload) is busy
+    sending. The producer is only submitted once the generator is first
+    iterated, and closing the generator stops it."""
+    q, stop, failed = queue.Queue(maxsize=depth), threading.Event(), []
+
+    def put(item):
+        # Give up after ~30 s (the upload timeout) if the consumer stalls.
+        for _ in range(30):
+            if stop.is_set(): return False
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        failed.append(TimeoutError("audio upload stalled: Azure stopped reading for 30 s"))
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put(chunk): return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    EXECUTOR.submit(produce)
     try:
-        r = requests.get(audio_url, timeout=30)
-        r.raise_for_status()
-        wav, err = convert_to_wav(r.content, '.mp3')
-        if wav: return wav, None
-        return None, err
+        while True:
+            for _ in range(30):
+                if failed: raise failed[0]
+                try:
+                    item = q.get(timeout=1)
+                    break
+                except queue.Empty:
+                    pass
+            else:
+                raise TimeoutError("audio source stalled: no data received for 30 s")
+            if item is None: return
+            if isinstance(item, Exception): raise item
+            yield item
+    finally:
+        stop.set()
+
+# Conditional-GET cache for source audio: url -> (etag, last_modified, audio,
+# content_type), holding the Azure-ready bytes so a 304 also skips transcoding.
+# Bounded by total bytes rather than entry count.
+AUDIO_CACHE      = LRUCache(maxsize=64 * 1024 * 1024, getsizeof=lambda entry: len(entry[2]))
+AUDIO_CACHE_LOCK = threading.Lock()
+
+def has_validators(src):
+    return bool(src.headers.get('ETag') or src.headers.get('Last-Modified'))
+
+def remember_audio(audio_url, src, audio, content_type):
+    if not has_validators(src):
+        return
+    with AUDIO_CACHE_LOCK:
+        try:
+            AUDIO_CACHE[audio_url] = (src.headers.get('ETag'), src.headers.get('Last-Modified'),
+                                      audio, content_type)
+        except ValueError:  # larger than the whole cache
+            pass
+
+class StreamBody:
+    """Upload body over a streamed download. Iterating it reads the source
+    ahead via prefetch(); close() releases the source connection whether or
+    not the body was ever iterated (e.g. the Azure connect failed)."""
+
+    def __init__(self, audio_url, src, head, chunks, content_type):
+        self.audio_url, self.src, self.head = audio_url, src, head
+        self.chunks, self.content_type = chunks, content_type
+        self.error = None   # set when the upload was aborted for size
+        self.audio = None   # full bytes, kept only when the source can be revalidated
+        self._iter = None
+
+    def __iter__(self):
+        self._iter = self._generate()
+        return self._iter
+
+    def _generate(self):
+        ahead = prefetch(self.chunks)
+        # Only keep a copy for AUDIO_CACHE when the source can be revalidated.
+        parts = [self.head] if has_validators(self.src) else None
+        try:
+            yield self.head
+            size = len(self.head)
+            for chunk in ahead:
+                size += len(chunk)
+                if size > MAX_AUDIO_BYTES:
+                    self.error = audio_size_error(size)
+                    raise ValueError(self.error)
+                if parts is not None:
+                    parts.append(chunk)
+                yield chunk
+            if parts is not None:
+                self.audio = b''.join(parts)
+                remember_audio(self.audio_url, self.src, self.audio, self.content_type)
+        finally:
+            ahead.close()
+
+    def close(self):
+        if self._iter is not None:
+            self._iter.close()
+        self.src.close()
+
+def download_audio(audio_url):
+    """Returns (body, content_type, error). Audio Azure accepts as-is is handed
+    over as a StreamBody (the caller must close it) so the upload overlaps the
+    download; anything else is buffered and transcoded to 16 kHz WAV. Repeat
+    URLs are revalidated with If-None-Match / If-Modified-Since and served
+    from AUDIO_CACHE on 304."""
+    try:
+        with AUDIO_CACHE_LOCK:
+            cached = AUDIO_CACHE.get(audio_url)
+        headers = {}
+        if cached:
+            if cached[0]: headers['If-None-Match']     = cached[0]
+            if cached[1]: headers['If-Modified-Since'] = cached[1]
+        src = SESSION.get(audio_url, headers=headers, stream=True, timeout=30)
+        if cached and src.status_code == 304:
+            src.close()
+            return cached[2], cached[3], None
+        src.raise_for_status()
+        # Size check off the GET's own headers: rejects empty/oversized files
+        # before any bytes are read, without a separate HEAD round trip.
+        if src.headers.get('Content-Length', '').isdigit():
+            size_err = audio_size_error(int(src.headers['Content-Length']))
+            if size_err:
+                src.close()
+                return None, None, size_err
+        chunks = src.iter_content(STREAM_CHUNK)
+        head   = next(chunks, b'')
+        # Without Content-Length, read on until MIN_AUDIO_BYTES; a source that
+        # ends first is rejected here, before a streamed upload can start.
+        while len(head) < MIN_AUDIO_BYTES:
+            more = next(chunks, None)
+            if more is None:
+                src.close()
+                return None, None, audio_size_error(len(head))
+            head += more
+        content_type = native_content_type(head)
+        if content_type:
+            return StreamBody(audio_url, src, head, chunks, content_type), content_type, None
+        with src:
+            raw = b''.join([head, *chunks])
+        size_err = audio_size_error(len(raw))
+        if size_err:
+            return None, None, size_err
+        audio, content_type, err = prepare_audio(raw)
+        if audio is not None:
+            remember_audio(audio_url, src, audio, content_type)
+        return audio, content_type, err
     except Exception as e:
-        return None, str(e)
+        return None, None, str(e)
 
 def build_silent_wav(duration_ms=200, sample_rate=16000):
     num_samples = int(sample_rate * duration_ms / 1000)
     pcm_data    = b'\x00\x00' * num_samples
-    data_size   = len(pcm_data)
-    header = struct.pack('<4sI4s4sIHHIIHH4sI',
-        b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16,
-        1, 1, sample_rate, sample_rate * 2, 2, 16,
-        b'data', data_size)
-    return header + pcm_data
+    return wav_header(len(pcm_data), sample_rate) + pcm_data
+
+# Text mode always sends the same 200 ms of silence.
+SILENT_WAV = build_silent_wav()
 
 def detect_audio_suffix(raw):
     if raw[:4] == b'RIFF':                      return None
@@ -75,99 +311,243 @@ def detect_audio_suffix(raw):
     if raw[:4] == b'\x00\x00\x00\x20' or raw[4:8] == b'ftyp': return '.mp4'
     return '.webm'
 
-def call_azure(audio_bytes, reference_text, language):
-    azure_key    = get_azure_key()
-    azure_region = get_azure_region()
-    pron_config  = {
-        "ReferenceText": reference_text,
-        "GradingSystem": "HundredMark",
-        "Granularity":   "Phoneme",
-        "Dimension":     "Comprehensive",
-        "EnableMiscue":  True,
-        "EnableProsodyAssessment": "true"
-    }
-    pron_b64 = base64.b64encode(json.dumps(pron_config).encode()).decode()
-    url = (f"https://{azure_region}.stt.speech.microsoft.com"
+def azure_content_type(raw):
+    if raw[:4] == b'RIFF':                      return WAV_CONTENT_TYPE
+    if raw[:4] == b'OggS':                      return OPUS_CONTENT_TYPE
+    return 'audio/webm; codecs=opus'
+
+def audio_digest(audio_bytes):
+    # blake2b is C-implemented and faster than sha256 on x86 without SHA-NI;
+    # the memoryview lets bytearray/memoryview buffers hash without a copy.
+    return hashlib.blake2b(memoryview(audio_bytes), digest_size=16).digest()
+
+# Word granularity: format_response only reads word-level scores, and the
+# per-phoneme/syllable arrays are the bulk of Azure's detailed response.
+PRON_CONFIG = {
+    "GradingSystem": "HundredMark",
+    "Granularity":   "Word",
+    "Dimension":     "Comprehensive",
+    "EnableMiscue":  True,
+    "EnableProsodyAssessment": "true"
+}
+
+@functools.lru_cache(maxsize=4096)
+def pron_header(reference_text):
+    pron_config = {"ReferenceText": reference_text, **PRON_CONFIG}
+    return base64.b64encode(orjson.dumps(pron_config)).decode()
+
+def call_azure(audio_bytes, reference_text, language, content_type=None):
+    url = (f"https://{get_azure_region()}.stt.speech.microsoft.com"
            f"/speech/recognition/conversation/cognitiveservices/v1"
            f"?language={language}&format=detailed&usePipelineVersion=0")
-    if audio_bytes[:4] == b'RIFF':
-        content_type = 'audio/wav; codecs=audio/pcm; samplerate=16000'
-    elif audio_bytes[:4] == b'\x1a\x45\xdf\xa3':
-        content_type = 'audio/webm; codecs=opus'
-    elif audio_bytes[:4] == b'OggS':
-        content_type = 'audio/ogg; codecs=opus'
-    else:
-        content_type = 'audio/webm; codecs=opus'
     headers = {
-        "Ocp-Apim-Subscription-Key": azure_key,
-        "Content-Type": content_type,
-        "Pronunciation-Assessment": pron_b64,
+        "Ocp-Apim-Subscription-Key": get_azure_key(),
+        "Content-Type": content_type or azure_content_type(audio_bytes),
+        "Pronunciation-Assessment": pron_header(reference_text),
         "Accept": "application/json"
     }
     try:
-        resp = requests.post(url, headers=headers, data=audio_bytes, timeout=30)
+        resp = AZURE_CLIENT.post(url, headers=headers, content=audio_bytes)
         if resp.status_code == 200:
-            return {"success": True, "data": resp.json()}
+            return {"success": True, "data": orjson.loads(resp.content)}
         return {"success": False, "error": f"Azure {resp.status_code}", "details": resp.text}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def format_response(azure_result, mode="audio"):
-    if not azure_result.get('success'):
-        return {
-            "success": False, "mode": mode,
-            "error":   azure_result.get('error', 'Unknown error'),
-            "details": azure_result.get('details', ''),
-            "feedback": "Sorry, assessment failed. Please try again."
-        }
-    try:
-        data       = azure_result.get('data', {}) or {}
-        nbest_list = data.get('NBest', [])
-        nbest      = nbest_list[0] if isinstance(nbest_list, list) and nbest_list else {}
-        pa    = nbest.get('PronunciationAssessment', {}) or {}
-        pron  = round(float(nbest.get('PronScore',         pa.get('PronScore',         0)) or 0), 1)
-        acc   = round(float(nbest.get('AccuracyScore',     pa.get('AccuracyScore',     0)) or 0), 1)
-        flu   = round(float(nbest.get('FluencyScore',      pa.get('FluencyScore',      0)) or 0), 1)
-        comp  = round(float(nbest.get('CompletenessScore', pa.get('CompletenessScore', 0)) or 0), 1)
-        pros  = round(float(nbest.get('ProsodyScore',      pa.get('ProsodyScore',      0)) or 0), 1)
-    except Exception as ex:
-        return {
-            "success": False, "mode": mode,
-            "error": f"Score parsing failed: {str(ex)}",
-            "details": str(azure_result.get('data', '')),
-            "feedback": "Assessment received but scores could not be parsed."
-        }
-
-    if   pron >= 90: feedback = f"Excellent! Pronunciation score: {pron}/100."
-    elif pron >= 75: feedback = f"Good job! Pronunciation score: {pron}/100."
-    elif pron >= 60: feedback = f"Not bad! Pronunciation score: {pron}/100."
-    else:            feedback = f"Keep practicing! Pronunciation score: {pron}/100."
-
-    words_out, weak = [], []
-    for w in (nbest.get('Words', []) or []):
-        w_pa = w.get('PronunciationAssessment', {}) or {}
-        ws   = round(float(w.get('AccuracyScore', w_pa.get('AccuracyScore', 0)) or 0), 1)
-        werr = w.get('ErrorType', w_pa.get('ErrorType', 'None')) or 'None'
-        words_out.append({"word": w.get('Word',''), "accuracy": ws, "error": werr})
-        if ws < 70 or werr not in ('None', ''):
-            weak.append(w.get('Word',''))
-    if weak:
-        feedback += f" Focus on: {', '.join(weak[:3])}."
-
-    return {
-        "success": True, "mode": mode,
-        "pronunciation_score": pron, "accuracy_score": acc,
-        "fluency_score": flu, "completeness_score": comp,
-        "prosody_score": pros, "feedback": feedback,
-        "words": words_out,
-        "recognized_text": nbest.get('Display', nbest.get('Lexical', ''))
+# Long passages: one Azure call takes as long as the whole utterance, so
+# passages over SPLIT_MIN_WORDS are cut at sentence breaks and the pieces
+# assessed in parallel. Only applies to 16 kHz mono PCM WAV, and only when
+# every break lines up with exactly one pause where the text predicts it;
+# if a break then looks misplaced, the whole clip is assessed in one call.
+
+SPLIT_MIN_WORDS        = 30
+SPLIT_MAX_PIECES       = 6       # Azure calls per passage
+SILENCE_FRAME          = 320     # 20 ms at 16 kHz
+SILENCE_PEAK           = 500     # |s16 sample| below this counts as silence
+MIN_SILENCE_FRAMES     = 15      # 300 ms
+SPLIT_WINDOW           = 0.25    # of the shorter neighbouring sentence's expected duration
+SCORE_KEYS = ('PronScore', 'AccuracyScore', 'FluencyScore', 'CompletenessScore', 'ProsodyScore')
+
+# Break after . ! ? (optionally closed by a quote/bracket, or by a French
+# " »") when the next sentence starts with a capital. "…" and "..." are not
+# treated as sentence ends.
+SENTENCE_END = re.compile(
+    r'(?:(?<=[.!?])|(?<=[.!?]["”’»)\]])|(?<=[.!?][ \u00a0]»))'
+    r'\s+(?=[«"“(\[]?[ \u00a0]?[A-ZÀ-ÖØ-Þ])')
+# "No. 5", "p. 12" and "Ex. 3" need no entry: a digit never starts a sentence.
+# French titles are matched case-sensitively since "me", "m" and "av" are
+# ordinary words or units in lower case.
+ABBREVIATIONS = frozenset({
+    'dr', 'mr', 'mrs', 'ms', 'st', 'mt', 'jr', 'sr', 'prof', 'vs', 'etc', 'fig', 'cf', 'pp',
+})
+TITLES = frozenset({'M', 'MM', 'Mme', 'Mlle', 'Me', 'Ste', 'Av', 'Boul'})
+INITIALISM = re.compile(r'(?:[^\W\d_]\.){2,}$|[^\W\d_a-zß-ÿ]\.$')   # "p.m.", "J."; not "5 m."
+
+def continues_sentence(piece):
+    last = piece.rsplit(None, 1)[-1].rstrip('"”’»)]')
+    if not last.endswith('.'):
+        return last.endswith('…')
+    return (last.endswith('..') or last[:-1].lower() in ABBREVIATIONS or last[:-1] in TITLES
+            or bool(INITIALISM.match(last)))
+
+def split_sentences(text):
+    """Sentence split that keeps abbreviations ("Dr.", "M.", "p.m."),
+    initials and ellipses attached to the words that follow them."""
+    sentences = []
+    for piece in SENTENCE_END.split(text.strip()):
+        if sentences and continues_sentence(sentences[-1]):
+            sentences[-1] += ' ' + piece
+        elif piece:
+            sentences.append(piece)
+    return sentences
+
+def find_pauses(samples):
+    """Returns (pauses, speech_start, speech_end) in samples, where pauses are
+    the midpoints of interior runs of at least MIN_SILENCE_FRAMES silent frames."""
+    pauses, quiet_from, speech_start, speech_end = [], None, None, 0
+    for i in range(0, len(samples), SILENCE_FRAME):
+        frame = samples[i:i + SILENCE_FRAME]
+        if max(frame) < SILENCE_PEAK and min(frame) > -SILENCE_PEAK:
+            if quiet_from is None:
+                quiet_from = i
+            continue
+        if speech_start is None:
+            speech_start = i
+        elif quiet_from is not None and i - quiet_from >= MIN_SILENCE_FRAMES * SILENCE_FRAME:
+            pauses.append((quiet_from + i) // 2)
+        quiet_from, speech_end = None, i + len(frame)
+    return pauses, speech_start or 0, speech_end
+
+def align_cuts(pauses, speech_start, speech_end, word_counts):
+    """One cut per sentence break, assuming a steady speaking rate: each break
+    must have exactly one pause within SPLIT_WINDOW of where the word counts
+    put it, otherwise None."""
+    total, span = sum(word_counts), speech_end - speech_start
+    cuts, words_before = [], 0
+    for before, after in zip(word_counts, word_counts[1:]):
+        words_before += before
+        expected = speech_start + span * words_before / total
+        window   = SPLIT_WINDOW * span * min(before, after) / total
+        near     = [p for p in pauses if abs(p - expected) <= window]
+        if len(near) != 1:
+            return None
+        cuts.append(near[0])
+    return cuts
+
+def edge_miscues(azure_result):
+    """(leading, trailing) runs of Omission/Insertion error types in a piece."""
+    words  = azure_result['data']['NBest'][0].get('Words') or []
+    errors = [w.get('ErrorType', (w.get('PronunciationAssessment') or {}).get('ErrorType'))
+              for w in words]
+    def run(seq):
+        out = []
+        for e in seq:
+            if e not in ('Omission', 'Insertion'):
+                break
+            out.append(e)
+        return out
+    return run(errors), run(reversed(errors))
+
+def cut_misplaced(before, after):
+    """A cut off the real sentence break shows up on both sides of it: words
+    omitted at the end of one piece and inserted at the start of the next (cut
+    too early), or the reverse (cut too late). A miscue on one side only is
+    just the reader's, and is scored as such."""
+    trailing, leading = edge_miscues(before)[1], edge_miscues(after)[0]
+    return (('Omission' in trailing and 'Insertion' in leading)
+            or ('Insertion' in trailing and 'Omission' in leading))
+
+def merge_results(results, weights):
+    nbests = [r['data']['NBest'][0] for r in results]
+    total  = sum(weights)
+    merged = {
+        key: sum(w * float(nb.get(key, (nb.get('PronunciationAssessment') or {}).get(key, 0)) or 0)
+                 for nb, w in zip(nbests, weights)) / total
+        for key in SCORE_KEYS
     }
+    merged['Words']   = [w for nb in nbests for w in (nb.get('Words') or [])]
+    merged['Display'] = ' '.join(nb.get('Display', '') for nb in nbests)
+    return {"success": True, "data": {"NBest": [merged]}}
+
+SPLIT_STATS      = {'split': 0, 'fallback': 0}   # reported by /health
+SPLIT_STATS_LOCK = threading.Lock()
+
+def count_split(outcome):
+    with SPLIT_STATS_LOCK:
+        SPLIT_STATS[outcome] += 1
+
+# Own pool so a few long passages can't starve the download read-ahead on
+# EXECUTOR; callers queue here once it is busy.
+SPLIT_EXECUTOR = ThreadPoolExecutor(max_workers=12, thread_name_prefix='split')
+
+def group_sentences(sentences, pieces):
+    """Joins consecutive sentences so there are at most `pieces` of them."""
+    size = -(-len(sentences) // pieces)
+    return [' '.join(sentences[i:i + size]) for i in range(0, len(sentences), size)]
+
+def split_call_azure(audio_bytes, reference_text, language):
+    """Parallel per-sentence assessment, or None when it does not apply."""
+    sentences = group_sentences(split_sentences(reference_text), SPLIT_MAX_PIECES)
+    if (len(reference_text.split()) <= SPLIT_MIN_WORDS or len(sentences) < 2
+            or native_content_type(audio_bytes) != WAV_CONTENT_TYPE or audio_bytes[36:40] != b'data'):
+        return None
+    word_counts = [len(sentence.split()) for sentence in sentences]
+    pcm     = memoryview(audio_bytes)[44:44 + (len(audio_bytes) - 44) // 2 * 2]
+    samples = array('h')
+    samples.frombytes(pcm)
+    cuts = align_cuts(*find_pauses(samples), word_counts)
+    if cuts is None:
+        return None
+    bounds  = [0, *cuts, len(samples)]
+    futures = [
+        SPLIT_EXECUTOR.submit(call_azure, b''.join([wav_header((end - start) * 2), pcm[start * 2:end * 2]]),
+                        sentence, language, WAV_CONTENT_TYPE)
+        for (start, end), sentence in zip(zip(bounds, bounds[1:]), sentences)
+    ]
+    results = [f.result() for f in futures]
+    if not all(r.get('success') and r['data'].get('NBest') for r in results):
+        reason = "piece failed"
+    elif any(cut_misplaced(a, b) for a, b in zip(results, results[1:])):
+        reason = "cut misplaced"
+    else:
+        count_split('split')
+        return merge_results(results, word_counts)
+    count_split('fallback')
+    app.logger.info("split assessment fell back to one call (%s, %d pieces)", reason, len(results))
+    return None
+
+# Assessment cache: practice loops replay the same audio / reference text,
+# so successful Azure results are reused for an hour.
+
+ASSESS_CACHE      = TTLCache(maxsize=10000, ttl=3600)
+ASSESS_CACHE_LOCK = threading.Lock()
+
+def cache_get(key):
+    with ASSESS_CACHE_LOCK:
+        return ASSESS_CACHE.get(key)
+
+def cache_put(key, azure_result):
+    if azure_result.get('success'):
+        with ASSESS_CACHE_LOCK:
+            ASSESS_CACHE[key] = azure_result
+
+def assess_key(audio_bytes, reference_text, language):
+    return (audio_digest(audio_bytes), reference_text, language)
+
+def cached_call_azure(audio_bytes, reference_text, language, content_type=None):
+    key = assess_key(audio_bytes, reference_text, language)
+    azure_result = cache_get(key)
+    if azure_result is None:
+        azure_result = (split_call_azure(audio_bytes, reference_text, language)
+                        or call_azure(audio_bytes, reference_text, language, content_type))
+        cache_put(key, azure_result)
+    return azure_result
 
 def run_continuous_session(ws, language, topic):
     try:
         import azure.cognitiveservices.speech as speechsdk
     except ImportError:
-        ws.send(json.dumps({"type": "error", "message": "Azure Speech SDK not installed"}))
+        ws.send(orjson.dumps({"type": "error", "message": "Azure Speech SDK not installed"}).decode())
         return
 
     azure_key    = get_azure_key()
@@ -206,7 +586,7 @@ def run_continuous_session(ws, language, topic):
             comp = round(pa.completeness_score     or 0, 1)
             words_out = []
             try:
-                detail = json.loads(evt.result.properties.get(
+                detail = orjson.loads(evt.result.properties.get(
                     speechsdk.PropertyId.SpeechServiceResponse_JsonResult, '{}'))
                 for w in (detail.get('NBest', [{}])[0].get('Words') or []):
                     w_pa = w.get('PronunciationAssessment', {})
@@ -219,7 +599,7 @@ def run_continuous_session(ws, language, topic):
                 pass
             session_scores.append(pron)
             try:
-                ws.send(json.dumps({
+                ws.send(orjson.dumps({
                     "type":                "sentence_result",
                     "text":                evt.result.text,
                     "pronunciation_score": pron,
@@ -227,14 +607,14 @@ def run_continuous_session(ws, language, topic):
                     "fluency_score":       flu,
                     "completeness_score":  comp,
                     "words":               words_out
-                }))
+                }).decode())
             except Exception:
                 done.set()
 
     def on_stopped(evt):  done.set()
     def on_canceled(evt):
         done.set()
-        try: ws.send(json.dumps({"type": "error", "message": "Recognition canceled"}))
+        try: ws.send(orjson.dumps({"type": "error", "message": "Recognition canceled"}).decode())
         except Exception: pass
 
     recognizer.recognized.connect(on_recognized)
@@ -242,7 +622,7 @@ def run_continuous_session(ws, language, topic):
     recognizer.canceled.connect(on_canceled)
 
     recognizer.start_continuous_recognition()
-    ws.send(json.dumps({"type": "session_started", "language": language}))
+    ws.send(orjson.dumps({"type": "session_started", "language": language}).decode())
 
     while not done.is_set():
         try:
@@ -252,7 +632,7 @@ def run_continuous_session(ws, language, topic):
             if isinstance(msg, bytes):
                 push_stream.write(msg)
             else:
-                data = json.loads(msg)
+                data = orjson.loads(msg)
                 if data.get('action') == 'stop':
                     break
         except Exception:
@@ -264,23 +644,20 @@ def run_continuous_session(ws, language, topic):
 
     if session_scores:
         avg = round(sum(session_scores) / len(session_scores), 1)
-        if   avg >= 90: sfb = f"Outstanding session! Average: {avg}/100."
-        elif avg >= 75: sfb = f"Great work! Average: {avg}/100."
-        elif avg >= 60: sfb = f"Good effort! Average: {avg}/100."
-        else:           sfb = f"Keep it up! Average: {avg}/100."
+        sfb = f"{tier_label(avg, SESSION_LABELS)} Average: {avg}/100."
         try:
-            ws.send(json.dumps({
+            ws.send(orjson.dumps({
                 "type":           "session_summary",
                 "sentence_count": len(session_scores),
                 "average_score":  avg,
                 "highest_score":  round(max(session_scores), 1),
                 "lowest_score":   round(min(session_scores), 1),
                 "feedback":       sfb
-            }))
+            }).decode())
         except Exception:
             pass
 
-    try: ws.send(json.dumps({"type": "session_ended"}))
+    try: ws.send(orjson.dumps({"type": "session_ended"}).decode())
     except Exception: pass
 
 
@@ -289,14 +666,14 @@ def assess_stream(ws):
     try:
         init_msg = ws.receive(timeout=10)
         if not init_msg:
-            ws.send(json.dumps({"type": "error", "message": "No init message"}))
+            ws.send(orjson.dumps({"type": "error", "message": "No init message"}).decode())
             return
-        init_data = json.loads(init_msg)
+        init_data = orjson.loads(init_msg)
         language  = init_data.get('language', 'fr-CA')
         topic     = init_data.get('topic', 'general')
         run_continuous_session(ws, language, topic)
     except Exception as e:
-        try: ws.send(json.dumps({"type": "error", "message": str(e)}))
+        try: ws.send(orjson.dumps({"type": "error", "message": str(e)}).decode())
         except Exception: pass
 
 
@@ -312,87 +689,162 @@ def health():
             test_result = r.stdout.decode()[:100]
         except Exception as e:
             test_result = str(e)
+    try:
+        import av
+        pyav_version = av.__version__
+    except ImportError:
+        pyav_version = None
     return jsonify({
         "status":       "running",
+        "pyav_version": pyav_version,
         "ffmpeg_found": ffmpeg_ok,
         "ffmpeg_path":  ffmpeg_path,
         "ffmpeg_info":  test_result,
         "azure_key":    len(get_azure_key()) > 0,
         "region":       get_azure_region(),
+        "split_calls":  dict(SPLIT_STATS),
     })
 
 
+HOME_ENDPOINTS = {
+    "one_shot":   "POST /assess",
+    "text_mode":  "POST /assess-text",
+    "continuous": "WS   /assess-stream",
+    "health":     "GET  /health",
+    "encrypt":    "POST /encrypt-pdf"
+}
+
 @app.route('/', methods=['GET'])
 def home():
-    key = get_azure_key()
     return jsonify({
         "status": "running",
         "service": "LTA Pronunciation Assessment API",
-        "azure_configured": len(key) > 0,
+        "azure_configured": len(get_azure_key()) > 0,
         "region": get_azure_region(),
-        "endpoints": {
-            "one_shot":   "POST /assess",
-            "text_mode":  "POST /assess-text",
-            "continuous": "WS   /assess-stream",
-            "health":     "GET  /health",
-            "encrypt":    "POST /encrypt-pdf"
-        }
+        "endpoints": HOME_ENDPOINTS
     })
 
 
+class AssessRequest(msgspec.Struct):
+    """Body of /assess and /assess-text. Unknown fields are ignored."""
+    reference_text: str | None = None
+    text:           str = ''
+    locale:         str | None = None
+    language:       str = 'fr-CA'
+    audio_url:      str = ''
+    audio_base64:   str = ''
+
+    @property
+    def reference(self):
+        return (self.text if self.reference_text is None else self.reference_text).strip()
+
+    @property
+    def lang(self):
+        return self.language if self.locale is None else self.locale
+
+def parse_assess_request():
+    """Returns (AssessRequest, error): one C-level decode + type check."""
+    body = request.get_data()
+    if not body:
+        return None, "No JSON data"
+    try:
+        return msgspec.json.decode(body, type=AssessRequest), None
+    except msgspec.DecodeError as e:
+        return None, f"Invalid request: {e}"
+
+MIN_REFERENCE_CHARS = 2
+
+def request_error(reference_text, language):
+    """Cheap checks that would otherwise only fail after a full Azure call."""
+    if not reference_text:
+        return "reference_text is required"
+    if len(reference_text) < MIN_REFERENCE_CHARS:
+        return f"reference_text must be at least {MIN_REFERENCE_CHARS} characters"
+    if language not in VALID_LANGUAGES:
+        return f"Unsupported language: {language} (see GET /languages)"
+    return None
+
+
 @app.route('/assess', methods=['POST'])
 def assess():
     if not get_azure_key():
         return jsonify({"success": False, "error": "Azure key not configured"}), 500
-    data = request.get_json()
-    if not data:
-        return jsonify({"success": False, "error": "No JSON data"}), 400
-    reference_text = data.get('reference_text', data.get('text', '')).strip()
-    language       = data.get('locale', data.get('language', 'fr-CA'))
-    audio_url      = data.get('audio_url', '')
-    audio_base64   = data.get('audio_base64', '')
-    if not reference_text:
-        return jsonify({"success": False, "error": "reference_text is required"}), 400
+    req, err = parse_assess_request()
+    if err:
+        return jsonify({"success": False, "error": err}), 400
+    reference_text = req.reference
+    language       = req.lang
+    audio_url      = req.audio_url
+    audio_base64   = req.audio_base64
+    err = request_error(reference_text, language)
+    if err:
+        return jsonify({"success": False, "error": err}), 400
 
     if audio_base64:
         try: raw = base64.b64decode(audio_base64)
         except Exception:
             return jsonify({"success": False, "error": "Invalid audio_base64"}), 400
-        return jsonify(format_response(call_azure(raw, reference_text, language), mode="audio"))
+        err = audio_size_error(len(raw))
+        if err:
+            return jsonify({"success": False, "error": f"Audio failed: {err}"}), 400
+        audio, content_type, err = prepare_audio(raw)
+        if audio is None:
+            return jsonify({"success": False, "error": f"Audio failed: {err}"}), 400
+        return jsonify(format_response(cached_call_azure(audio, reference_text, language, content_type), mode="audio"))
 
     if audio_url:
-        wav, err = download_and_convert(audio_url)
-        if not wav:
+        # No URL-keyed result cache: download_audio revalidates the source, so
+        # a changed recording is re-scored and an unchanged one (304) comes
+        # back as bytes that hit the digest-keyed cache.
+        body, content_type, err = download_audio(audio_url)
+        if body is None:
             return jsonify({"success": False, "error": f"Audio failed: {err}"}), 400
-        return jsonify(format_response(call_azure(wav, reference_text, language), mode="audio"))
+        if isinstance(body, bytes):
+            azure_result = cached_call_azure(body, reference_text, language, content_type)
+        else:
+            try:
+                azure_result = call_azure(body, reference_text, language, content_type)
+            finally:
+                body.close()
+            if body.error:
+                return jsonify({"success": False, "error": f"Audio failed: {body.error}"}), 400
+            if body.audio is not None:
+                cache_put(assess_key(body.audio, reference_text, language), azure_result)
+        return jsonify(format_response(azure_result, mode="audio"))
 
-    return jsonify(format_response(call_azure(build_silent_wav(), reference_text, language), mode="text"))
+    return jsonify(format_response(cached_call_azure(SILENT_WAV, reference_text, language), mode="text"))
 
 
 @app.route('/assess-text', methods=['POST'])
 def assess_text():
     if not get_azure_key():
         return jsonify({"success": False, "error": "Azure key not configured"}), 500
-    data = request.get_json()
-    if not data:
-        return jsonify({"success": False, "error": "No JSON data"}), 400
-    reference_text = data.get('reference_text', data.get('text', '')).strip()
-    language       = data.get('locale', data.get('language', 'fr-CA'))
-    if not reference_text:
-        return jsonify({"success": False, "error": "reference_text is required"}), 400
-    return jsonify(format_response(call_azure(build_silent_wav(), reference_text, language), mode="text"))
-
+    req, err = parse_assess_request()
+    if err:
+        return jsonify({"success": False, "error": err}), 400
+    reference_text = req.reference
+    language       = req.lang
+    err = request_error(reference_text, language)
+    if err:
+        return jsonify({"success": False, "error": err}), 400
+    return jsonify(format_response(cached_call_azure(SILENT_WAV, reference_text, language), mode="text"))
+
+
+LANGUAGES = [
+    {"code": "fr-CA", "name": "French (Canada) — Primary"},
+    {"code": "en-CA", "name": "English (Canada) — Primary"},
+    {"code": "en-US", "name": "English (US)"},
+    {"code": "fr-FR", "name": "French (France)"},
+    {"code": "es-MX", "name": "Spanish (Mexico)"},
+    {"code": "es-ES", "name": "Spanish (Spain)"},
+]
+LANGUAGES_JSON  = orjson.dumps(LANGUAGES)
+VALID_LANGUAGES = frozenset(lang["code"] for lang in LANGUAGES)
 
 @app.route('/languages', methods=['GET'])
 def languages():
-    return jsonify([
-        {"code": "fr-CA", "name": "French (Canada) — Primary"},
-        {"code": "en-CA", "name": "English (Canada) — Primary"},
-        {"code": "en-US", "name": "English (US)"},
-        {"code": "fr-FR", "name": "French (France)"},
-        {"code": "es-MX", "name": "Spanish (Mexico)"},
-        {"code": "es-ES", "name": "Spanish (Spain)"},
-    ])
+    return Response(LANGUAGES_JSON, mimetype='application/json',
+                    headers={'Cache-Control': 'public, max-age=86400'})
 
 
 @app.route('/encrypt-pdf', methods=['POST'])
@@ -447,7 +899,6 @@ def encrypt_pdf():
             with open(out_path, 'rb') as f:
                 encrypted_bytes = f.read()
 
-            from flask import Response
             return Response(
                 encrypted_bytes,
                 mimetype='application/pdf',
@@ -465,5 +916,6 @@ def encrypt_pdf():
 
 
 if __name__ == '__main__':
+    # Local development only; production runs under gunicorn (gunicorn.conf.py).
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    app.run(host='0.0.0.0', port=port, threaded=True)
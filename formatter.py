@@ -0,0 +1,68 @@
+"""
+Azure pronunciation result -> API response shaping.
+
+Kept in its own module with full annotations so it can be compiled with
+mypyc (`mypyc formatter.py`); app.py imports the compiled extension when
+it is present and this source otherwise.
+"""
+
+from bisect import bisect_right
+from typing import Any
+
+# Score tiers: labels[i] applies from SCORE_TIERS[i-1] (inclusive) up to SCORE_TIERS[i].
+SCORE_TIERS:     list[float] = [60, 75, 90]
+FEEDBACK_LABELS: list[str]   = ["Keep practicing!", "Not bad!", "Good job!", "Excellent!"]
+SESSION_LABELS:  list[str]   = ["Keep it up!", "Good effort!", "Great work!", "Outstanding session!"]
+
+
+def tier_label(score: float, labels: list[str]) -> str:
+    return labels[bisect_right(SCORE_TIERS, score)]
+
+
+def format_response(azure_result: dict[str, Any], mode: str = "audio") -> dict[str, Any]:
+    if not azure_result.get('success'):
+        return {
+            "success": False, "mode": mode,
+            "error":   azure_result.get('error', 'Unknown error'),
+            "details": azure_result.get('details', ''),
+            "feedback": "Sorry, assessment failed. Please try again."
+        }
+    try:
+        data: dict[str, Any]  = azure_result.get('data', {}) or {}
+        nbest_list            = data.get('NBest', [])
+        nbest: dict[str, Any] = nbest_list[0] if isinstance(nbest_list, list) and nbest_list else {}
+        pa: dict[str, Any]    = nbest.get('PronunciationAssessment', {}) or {}
+        pron: float = round(float(nbest.get('PronScore',         pa.get('PronScore',         0)) or 0), 1)
+        acc: float  = round(float(nbest.get('AccuracyScore',     pa.get('AccuracyScore',     0)) or 0), 1)
+        flu: float  = round(float(nbest.get('FluencyScore',      pa.get('FluencyScore',      0)) or 0), 1)
+        comp: float = round(float(nbest.get('CompletenessScore', pa.get('CompletenessScore', 0)) or 0), 1)
+        pros: float = round(float(nbest.get('ProsodyScore',      pa.get('ProsodyScore',      0)) or 0), 1)
+    except Exception as ex:
+        return {
+            "success": False, "mode": mode,
+            "error": f"Score parsing failed: {str(ex)}",
+            "details": str(azure_result.get('data', '')),
+            "feedback": "Assessment received but scores could not be parsed."
+        }
+
+    feedback = f"{tier_label(pron, FEEDBACK_LABELS)} Pronunciation score: {pron}/100."
+
+    words_out: list[dict[str, Any]] = [
+        {"word":     w.get('Word', ''),
+         "accuracy": round(float(w.get('AccuracyScore', (w_pa := w.get('PronunciationAssessment') or {})
+                                      .get('AccuracyScore', 0)) or 0), 1),
+         "error":    w.get('ErrorType', w_pa.get('ErrorType', 'None')) or 'None'}
+        for w in (nbest.get('Words', []) or [])
+    ]
+    weak: list[str] = [w["word"] for w in words_out if w["accuracy"] < 70 or w["error"] != 'None']
+    if weak:
+        feedback += f" Focus on: {', '.join(weak[:3])}."
+
+    return {
+        "success": True, "mode": mode,
+        "pronunciation_score": pron, "accuracy_score": acc,
+        "fluency_score": flu, "completeness_score": comp,
+        "prosody_score": pros, "feedback": feedback,
+        "words": words_out,
+        "recognized_text": nbest.get('Display', nbest.get('Lexical', ''))
+    }
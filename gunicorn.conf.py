@@ -0,0 +1,15 @@
+"""
+Gunicorn settings, loaded automatically by `gunicorn app:app`.
+
+/assess is I/O bound (audio download + Azure round trip), so each worker
+runs a large thread pool. gevent is not used: the Azure Speech SDK behind
+/assess-stream fires its callbacks on native threads, which does not mix
+with monkey-patched threading.
+"""
+import os
+
+bind         = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'gthread'
+workers      = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads      = int(os.environ.get('GUNICORN_THREADS', 32))
+keepalive    = 5